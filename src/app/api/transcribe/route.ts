@@ -1,15 +1,118 @@
 import { NextRequest, NextResponse } from 'next/server'
-import { writeFile, unlink } from 'fs/promises'
+import { writeFile, unlink, readFile } from 'fs/promises'
 import { join } from 'path'
 import { tmpdir } from 'os'
 import { v4 as uuidv4 } from 'uuid'
 import { formatTimeForSubtitle, formatTimeForVTT } from '@/lib/utils'
-import { spawn } from 'child_process'
+import { spawn, ChildProcess } from 'child_process'
 import { promisify } from 'util'
 import path from 'path'
 
 const exec = promisify(require('child_process').exec)
 
+// A single `whisper_cli.py --serve` worker keeps the model loaded across requests.
+// It reads one JSON job per stdin line and ends each job with a
+// {"done": true, "ok": ..., "id": ...} line, so jobs are run one at a time.
+interface WorkerJob {
+  id: string
+  onLine: (line: string) => void
+  onStderr: (message: string) => void
+  onExit: (code: number | null) => void
+}
+
+let worker: ChildProcess | null = null
+let currentJob: WorkerJob | null = null
+let jobQueue: Promise<void> = Promise.resolve()
+
+function getWorker(): ChildProcess {
+  if (worker) {
+    return worker
+  }
+
+  const pythonScript = path.join(process.cwd(), 'whisper_cli.py')
+  console.log(`Starting Python worker: python ${pythonScript} --serve`)
+
+  const child = spawn('python', [pythonScript, '--serve'], {
+    stdio: ['pipe', 'pipe', 'pipe'],
+    env: {
+      ...process.env,
+      PYTHONIOENCODING: 'utf-8',
+      PYTHONLEGACYWINDOWSFSENCODING: '0'
+    }
+  })
+  worker = child
+
+  // Decode as a stream so multi-byte characters split across chunks stay intact
+  child.stdout!.setEncoding('utf8')
+  let partialLine = ''
+  child.stdout!.on('data', (data: string) => {
+    const lines = (partialLine + data).split('\n')
+
+    // Keep the last line as partial if it doesn't end with newline
+    partialLine = lines.pop() || ''
+
+    for (const line of lines) {
+      if (!line.trim()) continue
+      if (currentJob) {
+        currentJob.onLine(line)
+      } else {
+        console.log('Worker output:', line.substring(0, 100))
+      }
+    }
+  })
+
+  child.stderr!.on('data', (data) => {
+    const errorMessage = data.toString()
+    console.error('Python worker stderr:', errorMessage)
+    currentJob?.onStderr(errorMessage)
+  })
+
+  child.stdin!.on('error', (error) => {
+    console.error('Python worker stdin error:', error)
+  })
+
+  child.on('error', (error) => {
+    console.error('Python worker error:', error)
+    if (worker === child) worker = null
+    currentJob?.onExit(-1)
+  })
+
+  child.on('close', (code) => {
+    console.log(`Python worker exited with code ${code}`)
+    if (worker === child) worker = null
+    currentJob?.onExit(code)
+  })
+
+  return child
+}
+
+function stopWorker() {
+  const child = worker
+  if (!child) return
+  worker = null
+  console.log('Stopping Python worker')
+  child.kill('SIGTERM')
+  // Force kill if process doesn't terminate gracefully
+  setTimeout(() => {
+    if (child.exitCode === null && child.signalCode === null) {
+      child.kill('SIGKILL')
+    }
+  }, 5000)
+}
+
+// Don't leave the worker behind when the server shuts down; if Node dies without
+// running this, the worker still exits once its stdin closes
+process.on('exit', () => {
+  worker?.kill('SIGKILL')
+})
+
+// Run jobs one after another on the shared worker
+function enqueueJob(task: () => Promise<void>): Promise<void> {
+  const run = jobQueue.then(task)
+  jobQueue = run.catch(() => {})
+  return run
+}
+
 export async function POST(request: NextRequest) {
   try {
     const data = await request.formData()
@@ -31,94 +134,93 @@ export async function POST(request: NextRequest) {
     await writeFile(filepath, buffer)
 
     try {
-      // Use local Whisper implementation
-      const pythonScript = path.join(process.cwd(), 'whisper_cli.py')
-      console.log(`Starting Python process: python ${pythonScript} ${filepath}`)
-      
-      // Use spawn instead of exec to get real-time output
-      const pythonProcess = spawn('python', [
-        pythonScript,
-        filepath,
-        '--model', model,
-        '--language', language === 'auto' ? '' : language,
-        '--format', 'json'
-      ], {
-        stdio: ['pipe', 'pipe', 'pipe'],
-        env: {
-          ...process.env,
-          PYTHONIOENCODING: 'utf-8',
-          PYTHONLEGACYWINDOWSFSENCODING: '0'
-        }
-      })
-
+      const jobId = uuidv4()
       let transcriptionResult: any = null
-      let lastProgress = 0
+      let resultFileRead: Promise<void> | null = null
+      let lastErrorStatus: string | null = null
+      let cancelled = false
 
       // Create a ReadableStream for SSE
       const stream = new ReadableStream({
-        async start(controller) {
-          // Handle client disconnect and process cleanup
-          const cleanup = () => {
-            console.log('Cleaning up: killing Python process')
-            if (!pythonProcess.killed) {
-              pythonProcess.kill('SIGTERM')
-              // Force kill if process doesn't terminate gracefully
-              setTimeout(() => {
-                if (!pythonProcess.killed) {
-                  pythonProcess.kill('SIGKILL')
-                }
-              }, 5000)
+        start(controller) {
+          // The client may disconnect while the job is still queued or running
+          const send = (payload: any) => {
+            if (cancelled) return
+            try {
+              controller.enqueue(`data: ${JSON.stringify(payload)}\n\n`)
+            } catch (e) {
+              console.log('Stream already closed')
             }
+          }
+          const closeStream = () => {
+            if (cancelled) return
             try {
-              require('fs').unlinkSync(filepath)
+              controller.close()
             } catch (e) {
-              console.log('Temp file already cleaned up')
+              console.log('Stream already closed')
             }
           }
-          
-          // Set up cleanup on various events
-          process.on('SIGTERM', cleanup)
-          process.on('SIGINT', cleanup)
-          
-          // Handle request cancellation (when user clicks cancel)
-          const handleCancellation = () => {
-            cleanup()
-            controller.enqueue(`data: ${JSON.stringify({
-              type: 'error',
-              message: 'Transcription cancelled by user'
-            })}\n\n`)
-            controller.close()
+
+          if (currentJob) {
+            send({ type: 'progress', progress: 0, status: 'Waiting for the current transcription to finish...' })
           }
-          let partialLine = ''
-          let resultSent = false  // Flag to prevent duplicate results
-          
-          pythonProcess.stdout.on('data', (data) => {
-            const rawData = partialLine + data.toString('utf8')
-            const lines = rawData.split('\n')
-            
-            // Keep the last line as partial if it doesn't end with newline
-            partialLine = lines.pop() || ''
-            
-            for (const line of lines) {
-              if (!line.trim()) continue
-              
-              // Handle result collection with base64 delimiter
-              const delimiter = "===TRANSCRIPTION_RESULT_B64==="
-              if (line.includes(delimiter)) {
-                if (resultSent) {
-                  console.log('Ignoring duplicate result')
-                  continue
+
+          return enqueueJob(() => new Promise<void>((resolve) => {
+            let finished = false
+            let resultSent = false  // Flag to prevent duplicate results
+
+            const finish = async (errorMessage: string | null) => {
+              if (finished) return
+              finished = true
+              if (currentJob === job) currentJob = null
+
+              try {
+                // Clean up temporary file
+                await unlink(filepath)
+              } catch (cleanupError) {
+                console.error('Error cleaning up temporary file:', cleanupError)
+              }
+
+              if (errorMessage === null) {
+                // Wait for the saved result file to be read, if one was reported
+                if (resultFileRead) {
+                  await resultFileRead
+                }
+                
+                // Log saved file info if available
+                if (transcriptionResult && transcriptionResult.saved_file) {
+                  console.log(`Transcription saved to: ${transcriptionResult.saved_file}`)
                 }
-                resultSent = true
                 
-                // Extract base64 JSON from between delimiters
-                const parts = line.split(delimiter)
-                if (parts.length >= 3) {
-                  const resultBase64 = parts[1]
+                // Send final transcription with saved file info
+                send({ type: 'complete', result: transcriptionResult })
+              } else {
+                send({ type: 'error', message: errorMessage })
+              }
+              closeStream()
+              resolve()
+            }
+
+            const job: WorkerJob = {
+              id: jobId,
+
+              onLine: (line) => {
+                // Handle result collection: RESULT\t<length>\t<json>
+                if (line.startsWith('RESULT\t')) {
+                  if (resultSent) {
+                    console.log('Ignoring duplicate result')
+                    return
+                  }
+                  resultSent = true
+                  
+                  const lengthEnd = line.indexOf('\t', 7)
+                  const resultLength = parseInt(line.substring(7, lengthEnd), 10)
+                  const resultJson = line.substring(lengthEnd + 1, lengthEnd + 1 + resultLength)
                   
                   try {
-                    // Decode base64 to get JSON string
-                    const resultJson = Buffer.from(resultBase64, 'base64').toString('utf-8')
+                    if (lengthEnd === -1 || resultJson.length !== resultLength) {
+                      throw new Error(`Expected ${resultLength} chars, got ${resultJson.length}`)
+                    }
                     const parsedResult = JSON.parse(resultJson)
                     
                     if (parsedResult && parsedResult.text && parsedResult.text.trim()) {
@@ -132,8 +234,8 @@ export async function POST(request: NextRequest) {
                     }
                     
                   } catch (e) {
-                    console.error('Failed to parse base64 result:', e)
-                    console.error('Raw base64 result:', resultBase64.substring(0, 500))
+                    console.error('Failed to parse result:', e)
+                    console.error('Raw result:', resultJson.substring(0, 500))
                     
                     // Ultimate fallback: create minimal result
                     transcriptionResult = {
@@ -141,99 +243,108 @@ export async function POST(request: NextRequest) {
                       language: "unknown"
                     }
                   }
+                  return
                 }
-                continue
-              }
-              
-              // Handle progress updates
-              try {
-                const jsonData = JSON.parse(line)
-                if (jsonData.progress !== undefined) {
-                  // Send progress update
-                  controller.enqueue(`data: ${JSON.stringify({
-                    type: 'progress',
-                    progress: jsonData.progress,
-                    status: jsonData.status
-                  })}\n\n`)
-                  lastProgress = jsonData.progress
+                
+                // Handle progress updates
+                try {
+                  const jsonData = JSON.parse(line)
+                  
+                  // End of a job: the worker is ready for the next one
+                  if (jsonData.done) {
+                    if (jsonData.id !== jobId) {
+                      console.log(`Ignoring end marker for job ${jsonData.id}`)
+                      return
+                    }
+                    finish(jsonData.ok ? null : (lastErrorStatus || 'Transcription failed'))
+                    return
+                  }
+                  
+                  // Final result is read from the file saved by the Python script
+                  if (jsonData.path && !resultSent) {
+                    resultSent = true
+                    const resultPath = jsonData.path
+                    // Awaited in finish() before 'complete' is sent
+                    resultFileRead = readFile(resultPath, 'utf8').then((resultJson) => {
+                      const parsedResult = JSON.parse(resultJson)
+                      
+                      if (parsedResult && parsedResult.text && parsedResult.text.trim()) {
+                        transcriptionResult = { ...parsedResult, saved_file: resultPath }
+                        console.log('Transcription result collected successfully')
+                      } else {
+                        transcriptionResult = {
+                          text: "Transcription completed but no text was extracted.",
+                          language: "unknown",
+                          saved_file: resultPath
+                        }
+                      }
+                    }).catch((e) => {
+                      console.error('Failed to read result file:', e)
+                      transcriptionResult = {
+                        text: "Transcription completed but result parsing failed. Check server logs for details.",
+                        language: "unknown"
+                      }
+                    })
+                  }
+                  
+                  if (jsonData.progress !== undefined) {
+                    if (typeof jsonData.status === 'string' && jsonData.status.startsWith('Error')) {
+                      lastErrorStatus = jsonData.status
+                    }
+                    // Send progress update
+                    send({
+                      type: 'progress',
+                      progress: jsonData.progress,
+                      status: jsonData.status
+                    })
+                  }
+                } catch (e) {
+                  console.log('Non-JSON output:', line.substring(0, 100) + '...')
+                }
+              },
+
+              onStderr: (errorMessage) => {
+                // Only send actual errors to frontend, not warnings or progress bars
+                if (errorMessage.includes('Error:') || errorMessage.includes('Exception:') || errorMessage.includes('Traceback:')) {
+                  send({ type: 'error', message: errorMessage })
+                }
+              },
+
+              onExit: (code) => {
+                if (code === null) {
+                  // Worker was killed (cancelled)
+                  finish('Transcription cancelled')
+                } else {
+                  console.error(`Python worker exited with code ${code} during a transcription`)
+                  finish(`Python process failed with exit code ${code}`)
                 }
-              } catch (e) {
-                console.log('Non-JSON output:', line.substring(0, 100) + '...')
               }
             }
-          })
-
-          pythonProcess.stderr.on('data', (data) => {
-            const errorMessage = data.toString()
-            console.error('Python script stderr:', errorMessage)
-            
-            // Only send actual errors to frontend, not warnings or progress bars
-            if (errorMessage.includes('Error:') || errorMessage.includes('Exception:') || errorMessage.includes('Traceback:')) {
-              controller.enqueue(`data: ${JSON.stringify({
-                type: 'error',
-                message: errorMessage
-              })}\n\n`)
+
+            if (cancelled) {
+              // The client left while the job was queued
+              finish('Transcription cancelled by user')
+              return
             }
-          })
 
-          await new Promise((resolve, reject) => {
-            pythonProcess.on('close', async (code) => {
-              try {
-                // Clean up temporary file
-                await unlink(filepath)
-              } catch (cleanupError) {
-                console.error('Error cleaning up temporary file:', cleanupError)
-              }
+            currentJob = job
+            const child = getWorker()
+            child.stdin!.write(JSON.stringify({
+              id: jobId,
+              video_path: filepath,
+              model,
+              language: language === 'auto' ? '' : language
+            }) + '\n')
+          }))
+        },
 
-              if (code === 0) {
-                // Send final transcription with saved file info
-                const response = {
-                  type: 'complete',
-                  result: transcriptionResult
-                }
-                
-                // Log saved file info if available
-                if (transcriptionResult && transcriptionResult.saved_file) {
-                  console.log(`Transcription saved to: ${transcriptionResult.saved_file}`)
-                }
-                
-                controller.enqueue(`data: ${JSON.stringify(response)}\n\n`)
-                controller.close()
-                resolve(null)
-              } else if (code === null) {
-                // Process was killed (cancelled)
-                controller.enqueue(`data: ${JSON.stringify({
-                  type: 'error',
-                  message: 'Transcription cancelled'
-                })}\n\n`)
-                controller.close()
-                resolve(null)
-              } else {
-                console.error(`Python process exited with code ${code}`)
-                controller.enqueue(`data: ${JSON.stringify({
-                  type: 'error',
-                  message: `Python process failed with exit code ${code}`
-                })}\n\n`)
-                reject(new Error(`Transcription failed with exit code ${code}`))
-              }
-            })
-            
-            pythonProcess.on('error', async (error) => {
-              try {
-                // Clean up temporary file on error
-                await unlink(filepath)
-              } catch (cleanupError) {
-                console.error('Error cleaning up temporary file:', cleanupError)
-              }
-              
-              console.error('Python process error:', error)
-              controller.enqueue(`data: ${JSON.stringify({
-                type: 'error',
-                message: `Process error: ${error.message}`
-              })}\n\n`)
-              reject(error)
-            })
-          })
+        // Handle request cancellation (when user clicks cancel)
+        cancel() {
+          cancelled = true
+          if (currentJob && currentJob.id === jobId) {
+            // The worker can't abort a job midway; restart it for the next request
+            stopWorker()
+          }
         }
       })
 
@@ -1,9 +1,12 @@
 import streamlit as st
 import whisper
+import torch
 import os
+import gc
 import tempfile
 import logging
 from pathlib import Path
+from collections import Counter
 import time
 import threading
 from datetime import datetime
@@ -15,6 +18,7 @@ logger = logging.getLogger(__name__)
 
 # Supported video formats
 SUPPORTED_FORMATS = ['.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm', '.m4v']
+_SUPPORTED_EXTENSIONS = frozenset(SUPPORTED_FORMATS)
 
 # Whisper model options
 WHISPER_MODELS = {
@@ -77,28 +81,25 @@ def get_video_files(folder_path):
     if not folder_path or not os.path.exists(folder_path):
         return []
     
-    video_files = []
-    for file in os.listdir(folder_path):
-        if any(file.lower().endswith(ext) for ext in SUPPORTED_FORMATS):
-            video_files.append(file)
-    
-    return sorted(video_files)
+    with os.scandir(folder_path) as entries:
+        return sorted(
+            entry.name for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in _SUPPORTED_EXTENSIONS
+        )
 
 def format_time(seconds):
     """Format seconds to HH:MM:SS,mmm format for SRT"""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    millis = int((seconds % 1) * 1000)
-    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+    hours, remainder = divmod(seconds, 3600)
+    minutes, secs = divmod(remainder, 60)
+    millis = int((secs % 1) * 1000)
+    return f"{int(hours):02d}:{int(minutes):02d}:{int(secs):02d},{millis:03d}"
 
 def format_time_vtt(seconds):
     """Format seconds to HH:MM:SS.mmm format for VTT"""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    millis = int((seconds % 1) * 1000)
-    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}"
+    hours, remainder = divmod(seconds, 3600)
+    minutes, secs = divmod(remainder, 60)
+    millis = int((secs % 1) * 1000)
+    return f"{int(hours):02d}:{int(minutes):02d}:{int(secs):02d}.{millis:03d}"
 
 def save_transcription(result, output_path, format_type):
     """Save transcription in the specified format"""
@@ -108,49 +109,81 @@ def save_transcription(result, output_path, format_type):
             f.write(result['text'])
     
     elif format_type == 'srt':
+        # Build the whole file in memory and write it once
         with open(output_path, 'w', encoding='utf-8') as f:
-            for i, segment in enumerate(result['segments'], 1):
-                start_time = format_time(segment['start'])
-                end_time = format_time(segment['end'])
-                text = segment['text'].strip()
-                f.write(f"{i}\n{start_time} --> {end_time}\n{text}\n\n")
+            f.write(''.join(
+                f"{i}\n{format_time(segment['start'])} --> {format_time(segment['end'])}\n{segment['text'].strip()}\n\n"
+                for i, segment in enumerate(result['segments'], 1)
+            ))
     
     elif format_type == 'vtt':
         with open(output_path, 'w', encoding='utf-8') as f:
-            f.write("WEBVTT\n\n")
-            for segment in result['segments']:
-                start_time = format_time_vtt(segment['start'])
-                end_time = format_time_vtt(segment['end'])
-                text = segment['text'].strip()
-                f.write(f"{start_time} --> {end_time}\n{text}\n\n")
+            f.write("WEBVTT\n\n" + ''.join(
+                f"{format_time_vtt(segment['start'])} --> {format_time_vtt(segment['end'])}\n{segment['text'].strip()}\n\n"
+                for segment in result['segments']
+            ))
     
     elif format_type == 'json':
         with open(output_path, 'w', encoding='utf-8') as f:
             json.dump(result, f, indent=2, ensure_ascii=False)
 
-def transcribe_video(video_path, model_name, language, output_format, output_folder, transcription_logger):
+# Keep one model resident across reruns; selecting another model evicts the previous one
+@st.cache_resource(max_entries=1, show_spinner="Loading Whisper model (compiling the encoder can take a minute)...")
+def get_whisper_model(model_name, device):
+    """Load a Whisper model, compiling the encoder on Tensor-core GPUs"""
+    model = whisper.load_model(model_name, device=device)
+    
+    if device == "cuda" and torch.cuda.get_device_capability()[0] >= 7:
+        eager_encoder = model.encoder
+        try:
+            # max_entries=1 has just evicted the previous model; drop its compiled
+            # graphs too instead of piling up recompiles on every model switch
+            torch.compiler.reset()
+            logger.info(f"Compiling the {model_name} encoder")
+            # The encoder always sees a fixed 30s mel window, so it suits CUDA graph capture;
+            # the decoder's growing KV-cache shapes would only trigger recompilation
+            model.encoder = torch.compile(model.encoder, mode="reduce-overhead", fullgraph=False)
+            
+            # Warm up once so the compile cost is not paid by the first transcription
+            dummy_mel = torch.zeros(1, model.dims.n_mels, 3000, device=device, dtype=torch.float16)
+            with torch.inference_mode():
+                model.encoder(dummy_mel)
+        except Exception as e:
+            # torch.compile needs Triton, which is missing on Windows and some setups
+            logger.warning(f"Encoder compilation failed, using the eager encoder: {e}")
+            model.encoder = eager_encoder
+    
+    return model
+
+def transcribe_video(video_path, model_name, language, output_format, output_folder, transcription_logger, keep_extension=False):
     """Transcribe video using local Whisper model"""
     try:
         transcription_logger.log(f"Starting transcription of: {os.path.basename(video_path)}")
         transcription_logger.update_progress(10, "Loading Whisper model...")
         
         # Load Whisper model locally
-        model = whisper.load_model(model_name)
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model = get_whisper_model(model_name, device)
         transcription_logger.log(f"Loaded Whisper model: {model_name}")
         transcription_logger.update_progress(20, "Model loaded, processing audio...")
         
         # Transcribe
-        transcribe_options = {}
+        transcribe_options = {'fp16': device == "cuda"}
         if language:
             transcribe_options['language'] = language
             
-        result = model.transcribe(video_path, **transcribe_options)
+        # inference_mode skips autograd version-counter bookkeeping
+        with torch.inference_mode():
+            result = model.transcribe(video_path, **transcribe_options)
         
         transcription_logger.update_progress(80, "Transcription complete, saving file...")
         transcription_logger.log(f"Transcription completed. Detected language: {result.get('language', 'unknown')}")
         
         # Save transcription
         video_name = Path(video_path).stem
+        if keep_extension:
+            # Another selected file has the same stem (clip.mp4 and clip.mkv); don't overwrite it
+            video_name = f"{video_name}_{Path(video_path).suffix.lstrip('.').lower()}"
         output_extension = output_format
         output_filename = f"{video_name}_transcription.{output_extension}"
         output_path = os.path.join(output_folder, output_filename)
@@ -180,6 +213,8 @@ def main():
     # Initialize session state
     if 'transcription_logger' not in st.session_state:
         st.session_state.transcription_logger = TranscriptionLogger()
+    if 'transcription_results' not in st.session_state:
+        st.session_state.transcription_results = []
     
     # Create columns for layout
     col1, col2 = st.columns([1, 1])
@@ -199,19 +234,19 @@ def main():
                 video_files = get_video_files(folder_path)
                 if video_files:
                     st.success(f"Found {len(video_files)} video file(s)")
-                    selected_video = st.selectbox(
-                        "Select Video File",
+                    selected_videos = st.multiselect(
+                        "Select Video Files",
                         video_files,
-                        help="Choose a video file to transcribe"
+                        help="Choose one or more video files to transcribe"
                     )
                 else:
                     st.warning("No video files found in the selected folder")
-                    selected_video = None
+                    selected_videos = []
             else:
                 st.error("Folder path does not exist")
-                selected_video = None
+                selected_videos = []
         else:
-            selected_video = None
+            selected_videos = []
         
         # Model selection
         model_name = st.selectbox(
@@ -221,6 +256,15 @@ def main():
             help="Larger models are more accurate but slower"
         )
         
+        if st.button("Unload Model", help="Free the memory held by the loaded Whisper model"):
+            get_whisper_model.clear()
+            # Compiled encoders keep Dynamo caches and CUDA graph pools alive
+            torch.compiler.reset()
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            st.session_state.transcription_logger.log("Unloaded Whisper model")
+        
         # Language selection
         language_name = st.selectbox(
             "🌍 Language",
@@ -275,8 +319,8 @@ def main():
     st.markdown("---")
     
     if st.button("🎯 Start Transcription", type="primary", use_container_width=True):
-        if not selected_video:
-            st.error("Please select a video file")
+        if not selected_videos:
+            st.error("Please select at least one video file")
         elif not output_folder or not os.path.exists(output_folder):
             st.error("Please specify a valid output folder")
         else:
@@ -285,40 +329,68 @@ def main():
             language = LANGUAGES[language_name]
             output_format = OUTPUT_FORMATS[output_format_name]
             
-            video_path = os.path.join(folder_path, selected_video)
+            # Similar file sizes (a rough proxy for duration) run back to back
+            video_paths = sorted(
+                (os.path.join(folder_path, video) for video in selected_videos),
+                key=os.path.getsize
+            )
+            stem_counts = Counter(Path(video).stem for video in selected_videos)
             
             # Start transcription
             st.session_state.transcription_logger.clear_logs()
             
-            with st.spinner("Transcribing video..."):
-                output_path, result = transcribe_video(
-                    video_path,
-                    model,
-                    language,
-                    output_format,
-                    output_folder,
-                    st.session_state.transcription_logger
-                )
+            # Results live in session state so they survive the rerun below and
+            # clicks on the download buttons
+            st.session_state.transcription_results = []
             
-            if output_path:
-                st.success(f"✅ Transcription completed successfully!")
-                st.info(f"📁 Output saved to: {output_path}")
+            # The model stays cached between files, so it is only loaded once
+            batch_progress = st.progress(0.0)
+            for index, video_path in enumerate(video_paths, 1):
+                batch_progress.progress(
+                    (index - 1) / len(video_paths),
+                    text=f"File {index}/{len(video_paths)}: {os.path.basename(video_path)}"
+                )
                 
-                # Show download button
-                if os.path.exists(output_path):
-                    with open(output_path, 'r', encoding='utf-8') as f:
-                        file_content = f.read()
-                    
-                    st.download_button(
-                        label="📥 Download Transcription",
-                        data=file_content,
-                        file_name=os.path.basename(output_path),
-                        mime="text/plain"
+                with st.spinner(f"Transcribing {os.path.basename(video_path)}..."):
+                    output_path, result = transcribe_video(
+                        video_path,
+                        model,
+                        language,
+                        output_format,
+                        output_folder,
+                        st.session_state.transcription_logger,
+                        keep_extension=stem_counts[Path(video_path).stem] > 1
                     )
-            else:
-                st.error("❌ Transcription failed. Check the logs for details.")
+                
+                # Read each output once here rather than on every rerun below;
+                # raw bytes: no decode here and re-encode inside Streamlit
+                file_content = None
+                if output_path is not None and os.path.exists(output_path):
+                    with open(output_path, 'rb') as f:
+                        file_content = f.read()
+                
+                st.session_state.transcription_results.append(
+                    (os.path.basename(video_path), output_path, file_content, output_path is not None)
+                )
             
             st.rerun()
+    
+    # Per-file results of the last run
+    for video, output_path, file_content, ok in st.session_state.transcription_results:
+        if ok:
+            st.success(f"✅ {video}: output saved to {output_path}")
+            
+            # Show download button
+            if file_content is not None:
+                st.download_button(
+                    label=f"📥 Download {os.path.basename(output_path)}",
+                    data=file_content,
+                    file_name=os.path.basename(output_path),
+                    mime="text/plain",
+                    key=output_path
+                )
+        else:
+            st.error(f"❌ Transcription of {video} failed. Check the logs for details.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
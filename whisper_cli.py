@@ -1,13 +1,13 @@
-import whisper
 import argparse
 import json
 import logging
-import torch
 import os
 import time
 import sys
-import codecs
-import base64
+import gc
+import re
+import unicodedata
+import warnings
 from datetime import datetime
 
 # Configure UTF-8 encoding for Windows compatibility
@@ -18,140 +18,225 @@ if sys.platform == 'win32':
     # Also set environment variables for subprocess
     os.environ['PYTHONIOENCODING'] = 'utf-8'
 
+# Suppress warnings and progress bars from appearing as errors
+warnings.filterwarnings("ignore")
+
 # Configure logging to stderr to avoid interfering with JSON output
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Limit CPU usage to prevent system freeze
-CPU_CORES = max(1, os.cpu_count() // 2)  # Use only half of available cores
-os.environ['OMP_NUM_THREADS'] = str(CPU_CORES)
-os.environ['MKL_NUM_THREADS'] = str(CPU_CORES)
-torch.set_num_threads(CPU_CORES)
+def default_cpu_threads():
+    """Physical cores available to this process, overridable with WHISPER_CPU_THREADS"""
+    env_threads = os.environ.get("WHISPER_CPU_THREADS")
+    if env_threads:
+        try:
+            return max(1, int(env_threads))
+        except ValueError:
+            logger.warning(f"Ignoring invalid WHISPER_CPU_THREADS={env_threads!r}")
+    
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False) or os.cpu_count()
+    except ImportError:
+        # Without psutil, approximate physical cores as half the logical CPUs (SMT)
+        cores = max(1, os.cpu_count() // 2)
+    
+    # Respect taskset / container CPU affinity limits
+    if hasattr(os, 'sched_getaffinity'):
+        cores = min(cores, len(os.sched_getaffinity(0)))
+    return max(1, cores)
+
+def set_cpu_threads(threads):
+    """Set the CPU thread count; must run before ctranslate2 is imported to affect OpenMP/MKL"""
+    global CPU_CORES
+    CPU_CORES = threads
+    os.environ['OMP_NUM_THREADS'] = str(CPU_CORES)
+    os.environ['MKL_NUM_THREADS'] = str(CPU_CORES)
+
+# The encoder is compute-bound on CPU, so use one thread per physical core
+CPU_CORES = None
+set_cpu_threads(default_cpu_threads())
+
+# Detected lazily by get_device() so ctranslate2 is only imported once work starts
+device = None
+
+def get_device():
+    """Detect GPU availability once, asking CTranslate2 rather than importing torch"""
+    global device
+    if device is None:
+        import ctranslate2
+        
+        gpu_count = ctranslate2.get_cuda_device_count()
+        device = "cuda" if gpu_count > 0 else "cpu"
+        print(json.dumps({"progress": 5, "status": f"Using device: {device}"}), flush=True)
+        if device == "cuda":
+            print(json.dumps({"progress": 8, "status": f"CUDA devices: {gpu_count}"}), flush=True)
+    return device
+
+def default_compute_type():
+    """Pick the CTranslate2 compute type for the current device"""
+    if get_device() == "cuda":
+        import ctranslate2
+        # int8 weights with float16 activations where the GPU supports it, else plain float16
+        supported = ctranslate2.get_supported_compute_types("cuda")
+        for compute_type in ("int8_float16", "float16"):
+            if compute_type in supported:
+                return compute_type
+        return "float32"
+    return "int8"
+
+class WhisperManager:
+    """Process-wide model cache so repeated transcriptions skip the model load"""
+    _model = None
+    _device = None
+    _model_size = None
+    _compute_type = None
+
+    @classmethod
+    def get_model(cls, model_name, compute_type):
+        """Return the cached model, loading it if the requested configuration changed"""
+        from faster_whisper import WhisperModel
+        
+        device = get_device()
+        if (cls._model is None or cls._model_size != model_name
+                or cls._device != device or cls._compute_type != compute_type):
+            cls.unload()
+            cls._model = WhisperModel(
+                model_name, device=device, compute_type=compute_type, cpu_threads=CPU_CORES
+            )
+            cls._device = device
+            cls._model_size = model_name
+            cls._compute_type = compute_type
+        return cls._model
+
+    @classmethod
+    def unload(cls):
+        """Release the cached model; CTranslate2 frees its memory when the model is collected"""
+        cls._model = None
+        cls._device = None
+        cls._model_size = None
+        cls._compute_type = None
+        gc.collect()
 
-# Check GPU availability
-device = "cuda" if torch.cuda.is_available() else "cpu"
-print(json.dumps({"progress": 5, "status": f"Using device: {device}"}), flush=True)
-if device == "cuda":
-    gpu_name = torch.cuda.get_device_name(0)
-    gpu_memory = torch.cuda.get_device_properties(0).total_memory / 1024**3
-    print(json.dumps({"progress": 8, "status": f"GPU: {gpu_name} ({gpu_memory:.1f} GB)"}), flush=True)
+# Problematic Unicode characters mapped to ASCII; C0/C1 control characters become spaces
+_SANITIZE_TRANSLATION = str.maketrans({
+    '\u2013': '-',   # en dash
+    '\u2014': '--',  # em dash
+    '\u2018': "'",   # left single quotation mark
+    '\u2019': "'",   # right single quotation mark
+    '\u201c': '"',   # left double quotation mark
+    '\u201d': '"',   # right double quotation mark
+    '\u2026': '...',  # ellipsis
+    '\u00a0': ' ',   # non-breaking space
+    # Letters that NFKD does not decompose into an ASCII base letter
+    'æ': 'ae', 'Æ': 'AE', 'ø': 'o', 'Ø': 'O',
+    **{chr(c): ' ' for c in [*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20), *range(0x7f, 0xa0)]},
+})
+_WHITESPACE_RE = re.compile(r'\s+')
 
-def transcribe_video(video_path, model_name='base', language=None):
+# Silero VAD settings: skip silences of 0.5s or longer, keeping 200ms of padding around speech
+VAD_PARAMETERS = {"min_silence_duration_ms": 500, "speech_pad_ms": 200}
+
+# Default batch size per model, bounded by VRAM use of the larger models
+DEFAULT_BATCH_SIZES = {'tiny': 16, 'base': 16, 'small': 8, 'medium': 4, 'large': 2}
+
+# Rough processing time per second of audio, used for the initial estimate
+TIME_MULTIPLIERS = {'tiny': 0.1, 'base': 0.2, 'small': 0.4, 'medium': 0.8, 'large': 1.5}
+
+def format_time(seconds):
+    """Format seconds in a human-readable way"""
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    elif seconds < 3600:
+        minutes = seconds // 60
+        secs = seconds % 60
+        return f"{minutes:.0f}m {secs:.0f}s"
+    else:
+        hours = seconds // 3600
+        minutes = (seconds % 3600) // 60
+        secs = seconds % 60
+        return f"{hours:.0f}h {minutes:.0f}m {secs:.0f}s"
+
+def sanitize_for_json(text):
+    """Sanitize text for safe JSON transmission"""
+    # NFKD splits accented letters into base letter + combining mark; encoding
+    # to ASCII then drops the marks and any other non-ASCII character in C
+    text = unicodedata.normalize('NFKD', text).translate(_SANITIZE_TRANSLATION)
+    text = text.encode('ascii', 'ignore').decode('ascii')
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+def progress_callback(progress, start_time, run_device, cpu_cores):
+    """Report transcription progress (0-1) with an estimate of the remaining time"""
+    elapsed = time.time() - start_time
+    if progress > 0:
+        estimated_total = elapsed / progress
+        remaining = estimated_total - elapsed
+        remaining_str = f", ~{format_time(remaining)} remaining" if remaining > 0 else ""
+    else:
+        remaining_str = ""
+    
+    print(json.dumps({
+        "progress": 50 + int(progress * 40), 
+        "status": f"Transcribing on {run_device} ({cpu_cores} cores)... {int(progress * 100)}%{remaining_str}"
+    }), flush=True)
+
+def transcribe_video(video_path, model_name='base', language=None, batch_size=None, compute_type=None):
     """Transcribe video using Whisper"""
     try:
+        from faster_whisper import BatchedInferencePipeline
+        
         start_time = time.time()
+        device = get_device()
         print(json.dumps({"progress": 10, "status": f"Starting transcription: {model_name} model"}), flush=True)
         
         # Report progress: Loading model
         print(json.dumps({"progress": 10, "status": "Loading model..."}), flush=True)
         
-        # Load Whisper model with explicit device
-        model = whisper.load_model(model_name, device=device)
-        print(json.dumps({"progress": 30, "status": "Model loaded, detecting audio..."}), flush=True)
-        
-        # Transcribe
-        options = {'language': language} if language else {}
+        # Load faster-whisper (CTranslate2) model with explicit device
+        if compute_type is None:
+            compute_type = default_compute_type()
+        print(json.dumps({"progress": 10, "status": f"Compute type: {compute_type}"}), flush=True)
+        model = WhisperManager.get_model(model_name, compute_type)
         
-        # Load audio and detect language if needed
-        audio = whisper.load_audio(video_path)
-        duration = len(audio)/16000
+        # Batch VAD-split chunks through the encoder instead of decoding 30s windows serially
+        batched_model = BatchedInferencePipeline(model=model)
+        if batch_size is None:
+            batch_size = DEFAULT_BATCH_SIZES.get(model_name, 8)
+        print(json.dumps({"progress": 30, "status": "Model loaded, detecting audio..."}), flush=True)
         
-        # Function to format time in a human-readable way
-        def format_time(seconds):
-            if seconds < 60:
-                return f"{seconds:.0f}s"
-            elif seconds < 3600:
-                minutes = seconds // 60
-                secs = seconds % 60
-                return f"{minutes:.0f}m {secs:.0f}s"
-            else:
-                hours = seconds // 3600
-                minutes = (seconds % 3600) // 60
-                secs = seconds % 60
-                return f"{hours:.0f}h {minutes:.0f}m {secs:.0f}s"
+        # Actual transcription - faster-whisper decodes the file itself and reports its
+        # duration in info; segments are yielded lazily as they are decoded, so
+        # progress is reported from the real position in the audio
+        segments, info = batched_model.transcribe(
+            video_path, language=language or None, beam_size=1, batch_size=batch_size,
+            vad_filter=True, vad_parameters=VAD_PARAMETERS
+        )
+        duration = info.duration
         
         # Estimate processing time based on model and audio duration
-        time_multipliers = {'tiny': 0.1, 'base': 0.2, 'small': 0.4, 'medium': 0.8, 'large': 1.5}
-        estimated_time = duration * time_multipliers.get(model_name, 0.5)
+        estimated_time = duration * TIME_MULTIPLIERS.get(model_name, 0.5)
         
         print(json.dumps({
             "progress": 50, 
             "status": f"Audio loaded ({format_time(duration)}), estimated time: {format_time(estimated_time)}"
         }), flush=True)
         
-        # Transcribe with progress callback
-        def progress_callback(progress):
-            elapsed = time.time() - start_time
-            if progress > 0:
-                estimated_total = elapsed / progress
-                remaining = estimated_total - elapsed
-                remaining_str = f", ~{format_time(remaining)} remaining" if remaining > 0 else ""
-            else:
-                remaining_str = ""
-            
-            print(json.dumps({
-                "progress": 50 + int(progress * 40), 
-                "status": f"Transcribing on {device} ({CPU_CORES} cores)... {int(progress * 100)}%{remaining_str}"
-            }), flush=True)
-        
-        # Suppress warnings and progress bars from appearing as errors
-        import warnings
-        warnings.filterwarnings("ignore")
-        
-        # Progress tracking variables
-        segment_progress = 0
-        total_segments = 0
+        collected_segments = []
+        for segment in segments:
+            collected_segments.append({
+                "id": segment.id,
+                "start": segment.start,
+                "end": segment.end,
+                "text": segment.text
+            })
+            if duration > 0:
+                progress_callback(min(segment.end / duration, 1.0), start_time, device, CPU_CORES)
         
-        # Custom progress hook for better tracking
-        def on_progress(progress_info):
-            nonlocal segment_progress, total_segments
-            
-            if 'segment' in progress_info:
-                segment_progress += 1
-                if total_segments > 0:
-                    progress = segment_progress / total_segments
-                    progress_callback(progress)
-        
-        # Transcribe with simulated progress tracking
-        import threading
-        import asyncio
-        
-        # Variables for progress simulation
-        simulation_progress = 0
-        transcription_done = False
-        
-        def simulate_progress():
-            nonlocal simulation_progress, transcription_done
-            total_duration = len(audio) / 16000
-            expected_time = total_duration * time_multipliers.get(model_name, 0.5)
-            
-            # Simulate progress over expected time
-            steps = max(10, int(expected_time / 5))  # Update every 5 seconds or 10 steps minimum
-            step_time = expected_time / steps
-            
-            for i in range(steps):
-                if transcription_done:
-                    break
-                    
-                # Non-linear progress (faster at start, slower at end)
-                raw_progress = i / steps
-                simulation_progress = raw_progress * (2 - raw_progress)  # Ease-out curve
-                
-                progress_callback(simulation_progress)
-                time.sleep(step_time)
-        
-        # Start progress simulation in background
-        progress_thread = threading.Thread(target=simulate_progress, daemon=True)
-        progress_thread.start()
-        
-        try:
-            # Actual transcription
-            result = model.transcribe(audio, **options, verbose=False)
-            transcription_done = True
-            
-        except Exception as e:
-            transcription_done = True
-            raise e
+        result = {
+            "text": "".join(segment["text"] for segment in collected_segments),
+            "segments": collected_segments,
+            "language": info.language
+        }
         
         print(json.dumps({"progress": 90, "status": "Finalizing transcription..."}), flush=True)
         
@@ -166,47 +251,6 @@ def transcribe_video(video_path, model_name='base', language=None):
             print(json.dumps({"progress": 0, "status": "Error: Empty transcription result"}), flush=True)
             return None
             
-        # Clean up the text to avoid JSON issues
-        import re
-        import unicodedata
-        
-        def sanitize_for_json(text):
-            """Sanitize text for safe JSON transmission"""
-            # Normalize Unicode
-            text = unicodedata.normalize('NFKD', text)
-            
-            # Remove control characters
-            text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', ' ', text)
-            
-            # Replace problematic Unicode characters
-            replacements = {
-                '\u2013': '-',   # en dash
-                '\u2014': '--',  # em dash
-                '\u2018': "'",   # left single quotation mark
-                '\u2019': "'",   # right single quotation mark
-                '\u201c': '"',   # left double quotation mark
-                '\u201d': '"',   # right double quotation mark
-                '\u2026': '...',  # ellipsis
-                '\u00a0': ' ',   # non-breaking space
-            }
-            
-            for old, new in replacements.items():
-                text = text.replace(old, new)
-            
-            # Keep only safe characters: printable ASCII + common accented characters
-            text = ''.join(c for c in text if (
-                c.isprintable() and ord(c) < 127  # ASCII printable
-            ) or c in 'àáâãäåæçèéêëìíîïñòóôõöøùúûüý'  # Common accents
-              or c in 'ÀÁÂÃÄÅÆÇÈÉÊËÌÍÎÏÑÒÓÔÕÖØÙÚÛÜÝ'  # Uppercase accents
-              or c in '\n\r\t '  # Whitespace
-            )
-            
-            # Normalize whitespace
-            text = re.sub(r'\s+', ' ', text)
-            text = text.strip()
-            
-            return text
-        
         # Apply sanitization
         text = sanitize_for_json(text)
         
@@ -243,22 +287,24 @@ def transcribe_video(video_path, model_name='base', language=None):
             logger.error(f"Error saving transcription file: {str(e)}")
             print(json.dumps({"progress": 0, "status": f"Error saving file: {str(e)}"}, ensure_ascii=True), flush=True)
         
-        # Send result with base64 encoding to avoid JSON parsing issues
+        # The parent reads the saved file, so only its path goes over stdout
+        if "saved_file" in final_result:
+            print(json.dumps({
+                "progress": 100,
+                "status": "Transcription complete",
+                "path": final_result["saved_file"]
+            }), flush=True)
+            return final_result
+        
+        # Saving failed: send result as length-prefixed JSON on a single line;
+        # ensure_ascii keeps non-ASCII characters from being mangled by the pipe encoding
         try:
-            # Create JSON with original text (no extra escaping needed)
-            json_str = json.dumps(final_result, ensure_ascii=False)
+            payload = json.dumps(final_result, ensure_ascii=True)
             
-            # Encode to base64 for safe transmission
-            json_bytes = json_str.encode('utf-8')
-            json_base64 = base64.b64encode(json_bytes).decode('ascii')
-            
-            # Debug: Add unique identifier to ensure single send
             logger.info(f"Sending transcription result (length: {len(text)} chars)")
-            logger.info(f"Base64 JSON length: {len(json_base64)} chars")
             
-            # Send result with base64 encoding and unique delimiter
-            delimiter = "===TRANSCRIPTION_RESULT_B64==="
-            print(f"{delimiter}{json_base64}{delimiter}", flush=True)
+            sys.stdout.write(f"RESULT\t{len(payload)}\t{payload}\n")
+            sys.stdout.flush()
             
         except Exception as e:
             logger.error(f"Error formatting result: {str(e)}")
@@ -271,18 +317,79 @@ def transcribe_video(video_path, model_name='base', language=None):
         print(json.dumps({"progress": 0, "status": f"Error: {str(e)}"}), flush=True)
         raise
 
+def serve(args):
+    """Transcribe one request per stdin line, keeping the model loaded between requests
+
+    Each line is a JSON object such as {"id": "...", "video_path": "..."}; "model",
+    "language", "batch_size" and "compute_type" are optional and default to the CLI
+    arguments. Output per request is the same progress/result stream as a single run,
+    followed by {"done": true, "ok": <bool>, "id": <request id>} once the job is over.
+    """
+    get_device()
+    print(json.dumps({"progress": 0, "status": "Worker ready"}), flush=True)
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            video_path = request['video_path']
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(json.dumps({"progress": 0, "status": f"Error: invalid request: {str(e)}"}), flush=True)
+            print(json.dumps({"done": True, "ok": False, "id": request_id}), flush=True)
+            continue
+        ok = False
+        try:
+            ok = transcribe_video(
+                video_path,
+                request.get('model', args.model),
+                request.get('language', args.language),
+                request.get('batch_size', args.batch_size),
+                request.get('compute_type', args.compute_type)
+            ) is not None
+        except Exception as e:
+            # transcribe_video already reported the error; keep the worker alive
+            logger.error(f"Transcription failed: {str(e)}")
+        print(json.dumps({"done": True, "ok": ok, "id": request_id}), flush=True)
+    WhisperManager.unload()
+
 def main():
     parser = argparse.ArgumentParser(description='Transcribe video using Whisper')
-    parser.add_argument('video_path', help='Path to video file')
+    parser.add_argument('video_path', nargs='?', help='Path to video file (omit with --serve)')
     parser.add_argument('--model', default='base', help='Whisper model to use')
     parser.add_argument('--language', default=None, help='Language code (optional)')
     parser.add_argument('--format', default='txt', help='Output format')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='Chunks decoded per batch (default: 16 tiny/base, 8 small, 4 medium, 2 large)')
+    parser.add_argument('--compute-type', default=None,
+                        choices=['int8', 'int8_float16', 'int8_float32', 'float16', 'float32'],
+                        help='Model precision (default: int8 on CPU, int8_float16 on GPUs that '
+                             'support it, float16 on older GPUs). int8 quantization '
+                             'halves weight memory traffic at the cost of a slightly higher word '
+                             'error rate; use float16/float32 when accuracy matters most')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='CPU threads to use (default: WHISPER_CPU_THREADS or the number of physical cores)')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run as a long-lived worker reading {"video_path": ...} JSON lines from stdin')
     
     args = parser.parse_args()
     
+    if args.threads is not None:
+        if args.threads < 1:
+            parser.error('--threads must be at least 1')
+        set_cpu_threads(args.threads)
+    
+    if args.serve:
+        serve(args)
+        return
+    if not args.video_path:
+        parser.error('video_path is required unless --serve is given')
+    
     try:
         # Just call the transcription function - it handles all output
-        transcribe_video(args.video_path, args.model, args.language)
+        transcribe_video(args.video_path, args.model, args.language, args.batch_size, args.compute_type)
         
     except Exception as e:
         logger.error(f"Transcription failed: {str(e)}")